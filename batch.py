@@ -0,0 +1,319 @@
+#! /usr/bin/env python3
+"""
+evaluate many expressions that share a few shapes with NumPy
+
+every line is split into its shape (the text with integer literals replaced
+by `#`) and its literals, and lines are grouped by shape. each shape is
+parsed once, then evaluated column-wise over the literal matrix of all the
+lines sharing it. integer columns are only used while their magnitude
+provably stays below 2 ** 53, where int64 arithmetic and int to float
+conversion are exact, so results are identical to calc8's. lines NumPy
+can't do exactly (division by zero, huge numbers, odd input) are evaluated
+one by one by calc8, which also raises their errors.
+
+usage: batch.py FILE
+"""
+from collections import defaultdict
+import operator
+import re
+import sys
+
+import numpy as np
+
+from calc8 import (And, Compare, Cond, Lexer, NodeVisitor, Num, Or, Parser,
+                   Product, Sum, UnaryOp, evaluate)
+
+# int64 math on values below this bound is exact, and so is the conversion
+# to float
+EXACT = 2 ** 53
+MAX_DIGITS = 15
+
+
+class Inexact(Exception):
+    pass
+
+
+class ColumnEvaluator(NodeVisitor):
+    """
+    visit() returns (array, bound), bound is the largest magnitude an int64
+    array may hold or None for a float64 array, booleans are bool arrays
+    with bound 1. rows whose result numpy can't reproduce are flagged in
+    self.fallback. every operand is computed for all rows, self.live masks
+    the rows calc8 would actually evaluate it for, so only those are flagged.
+    """
+
+    def __init__(self, columns, bindings):
+        self.columns = columns
+        self.bindings = bindings
+        self.fallback = np.zeros(len(columns), dtype=bool)
+        self.live = np.ones(len(columns), dtype=bool)
+
+    def check(self, bound):
+        if bound >= EXACT:
+            raise Inexact()
+        return bound
+
+    def visit_Num(self, node):
+        column = self.columns[:, node.value]
+        return column, self.check(int(column.max()))
+
+    def visit_Var(self, node):
+        value = self.bindings.get(node.name)
+        if type(value) is int:
+            return (np.full(len(self.columns), value, dtype=np.int64),
+                    self.check(abs(value)))
+        if type(value) is float:
+            return np.full(len(self.columns), value), None
+        raise Inexact()
+
+    def visit_UnaryOp(self, node):
+        array, bound = self.visit(node.child)
+        if node.op is operator.not_:
+            return array == 0, 1
+        return node.op(as_number(array)), bound
+
+    def visit_Compare(self, node):
+        live = self.live
+        left, _ = self.visit(node.operands[0])
+        result = np.ones(len(self.columns), dtype=bool)
+        for op, operand in zip(node.ops, node.operands[1:]):
+            self.live = live & result
+            right, _ = self.visit(operand)
+            result = result & op(left, right)
+            left = right
+        self.live = live
+        return result, 1
+
+    def visit_And(self, node):
+        return self.logical(node.operands, np.logical_and, True)
+
+    def visit_Or(self, node):
+        return self.logical(node.operands, np.logical_or, False)
+
+    def logical(self, operands, combine, undecided):
+        live = self.live
+        result = np.full(len(self.columns), undecided)
+        for operand in operands:
+            self.live = live & (result == undecided)
+            result = combine(result, self.visit(operand)[0] != 0)
+        self.live = live
+        return result, 1
+
+    def visit_Cond(self, node):
+        live = self.live
+        test = self.visit(node.test)[0] != 0
+        self.live = live & test
+        body, body_bound = self.visit(node.body)
+        self.live = live & ~test
+        orelse, orelse_bound = self.visit(node.orelse)
+        self.live = live
+        if body.dtype != orelse.dtype:
+            # the rows would get results of different types
+            if not (live & test).any():
+                return orelse, orelse_bound
+            if not (live & ~test).any():
+                return body, body_bound
+            raise Inexact()
+        if body_bound is None:
+            return np.where(test, body, orelse), None
+        return np.where(test, body, orelse), max(body_bound, orelse_bound)
+
+    def visit_Sum(self, node):
+        values = ((as_number(value), bound)
+                  for value, bound in map(self.visit, node.operands))
+        result, bound = next(values)
+        for (value, value_bound), negated in zip(values, node.negated[1:]):
+            if bound is not None and value_bound is not None:
+                bound = self.check(bound + value_bound)
+            else:
+                result, value, bound = as_float(result), as_float(value), None
+            result = result - value if negated else result + value
+        return result, bound
+
+    def visit_Product(self, node):
+        values = ((as_number(value), bound)
+                  for value, bound in map(self.visit, node.operands))
+        result, bound = next(values)
+        for (value, value_bound), inverted in zip(values, node.inverted[1:]):
+            if inverted:
+                self.fallback |= (value == 0) & self.live
+                result, bound = as_float(result) / as_float(value), None
+            elif bound is not None and value_bound is not None:
+                bound = self.check(bound * value_bound)
+                result = result * value
+            else:
+                result, bound = as_float(result) * as_float(value), None
+        return result, bound
+
+
+def as_float(array):
+    return array.astype(np.float64)
+
+
+def as_number(array):
+    """
+    booleans count as 0 and 1 in arithmetic, numpy's bool + bool is an or
+    """
+    return array.astype(np.int64) if array.dtype == bool else array
+
+
+def template(shape):
+    """
+    the shape with every `#` turned into a Num whose value is the index of
+    its literal column
+    """
+    text = shape.replace('#', '0')
+    columns = {}
+    for match in re.finditer('#', shape):
+        columns[match.start()] = len(columns)
+    tree = Parser(Lexer(text), spans=True).parse()
+    return Renumber(columns).visit(tree)
+
+
+class Renumber(NodeVisitor):
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def visit_Num(self, node):
+        return Num(self.columns[node.span[0]], node.span)
+
+    def visit_Var(self, node):
+        return node
+
+    def visit_UnaryOp(self, node):
+        return UnaryOp(node.op, self.visit(node.child), node.span)
+
+    def visit_Sum(self, node):
+        return Sum(tuple(map(self.visit, node.operands)), node.negated,
+                   node.span)
+
+    def visit_Product(self, node):
+        return Product(tuple(map(self.visit, node.operands)), node.inverted,
+                       node.span)
+
+    def visit_Compare(self, node):
+        return Compare(tuple(map(self.visit, node.operands)), node.ops,
+                       node.span)
+
+    def visit_And(self, node):
+        return And(tuple(map(self.visit, node.operands)), node.span)
+
+    def visit_Or(self, node):
+        return Or(tuple(map(self.visit, node.operands)), node.span)
+
+    def visit_Cond(self, node):
+        return Cond(self.visit(node.test), self.visit(node.body),
+                    self.visit(node.orelse), node.span)
+
+
+def evaluate_group(shape, columns, bindings):
+    """
+    the results for a literal matrix and a mask of the rows numpy couldn't
+    do, None when it couldn't do any
+    """
+    try:
+        tree = template(shape)
+        evaluator = ColumnEvaluator(columns, bindings)
+        with np.errstate(all='ignore'):
+            result, _ = evaluator.visit(tree)
+    except Exception:
+        return None
+    return result, evaluator.fallback
+
+
+def split_literals(text):
+    """
+    the shape text and the value of every literal of an ascii text, plus
+    which literals have too many digits to be read exactly. works on the
+    bytes with numpy so no python code runs per line or per literal.
+    """
+    data = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    digit = (data >= ord('0')) & (data <= ord('9'))
+    letter = ((data | 0x20) >= ord('a')) & ((data | 0x20) <= ord('z'))
+    word = digit | letter | (data == ord('_'))
+    # digit runs, a run right after a letter, digit or `_` belongs to a name
+    run_starts = np.flatnonzero(digit & ~np.r_[False, digit[:-1]])
+    run_ends = np.flatnonzero(digit & ~np.r_[digit[1:], False])
+    literal_run = ~np.r_[False, word[:-1]][run_starts]
+    starts = run_starts[literal_run]
+    ends = run_ends[literal_run] + 1
+    lengths = ends - starts
+    too_long = lengths > MAX_DIGITS
+
+    # every literal digit times its power of ten, summed up per literal
+    run = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(lengths.sum()) - \
+        np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[run]
+    exponents = np.minimum(ends[run] - positions - 1, MAX_DIGITS)
+    values = (data[positions] - ord('0')).astype(np.int64) * \
+        10 ** exponents.astype(np.int64)
+    literals = np.add.reduceat(values, np.cumsum(lengths) - lengths) \
+        if len(starts) else np.zeros(0, dtype=np.int64)
+    literals[too_long] = 0
+
+    shape = data.copy()
+    shape[starts] = ord('#')
+    keep = np.ones(len(data), dtype=bool)
+    keep[positions] = False
+    keep[starts] = True
+    return shape[keep].tobytes().decode('ascii'), literals, too_long
+
+
+def evaluate_batch(lines, bindings=None, min_group=16):
+    """
+    the same as [calc8.evaluate(line, bindings) for line in lines]
+    """
+    if not lines:
+        return []
+    bindings = {} if bindings is None else bindings
+    text = '\n'.join(lines)
+    unusual = np.zeros(len(lines), dtype=bool)
+    if not text.isascii() or '#' in text or \
+            text.count('\n') != len(lines) - 1:
+        unusual = np.array([not line.isascii() or '#' in line or
+                            '\n' in line for line in lines], dtype=bool)
+        text = '\n'.join('' if skip else line
+                         for line, skip in zip(lines, unusual))
+    shape, literals, too_long = split_literals(text)
+
+    groups = defaultdict(list)
+    for index, line_shape in enumerate(shape.split('\n')):
+        groups[line_shape].append(index)
+    counts = np.zeros(len(lines), dtype=np.int64)
+    for line_shape, rows in groups.items():
+        counts[rows] = line_shape.count('#')
+    offsets = np.cumsum(counts) - counts
+    unusual[np.repeat(np.arange(len(lines)), counts)[too_long]] = True
+
+    results = np.empty(len(lines), dtype=object)
+    pending = np.array(unusual)
+    for line_shape, rows in groups.items():
+        rows = np.array(rows)
+        rows = rows[~unusual[rows]]
+        if len(rows) < min_group:
+            pending[rows] = True
+            continue
+        columns = literals[offsets[rows][:, None] +
+                           np.arange(line_shape.count('#'))]
+        done = evaluate_group(line_shape, columns, bindings)
+        if done is None:
+            pending[rows] = True
+            continue
+        values, fallback = done
+        results[rows] = values.astype(object)
+        pending[rows[fallback]] = True
+
+    for index in np.flatnonzero(pending).tolist():
+        results[index] = evaluate(lines[index], bindings)
+    return results.tolist()
+
+
+def main():
+    with open(sys.argv[1]) as f:
+        for result in evaluate_batch(f.read().splitlines()):
+            print(result)
+
+
+if __name__ == '__main__':
+    main()
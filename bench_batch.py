@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+"""
+shape-heavy batches: one calc8 evaluation per line against batch.py
+"""
+import random
+import sys
+import time
+
+from batch import evaluate_batch
+from calc8 import compile_formula, evaluate
+
+SHAPES = [
+    '# * (# + #) - #',
+    '(# + #) / # - # * #',
+    '-# + # * # * #',
+    '(# - #) * (# + #) / (# + 1)',
+]
+
+
+def make_lines(n, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(n):
+        line = rng.choice(SHAPES)
+        while '#' in line:
+            line = line.replace('#', str(rng.randint(1, 10 ** 4)), 1)
+        lines.append(line)
+    return lines
+
+
+def timed(function, lines):
+    start = time.perf_counter()
+    function(lines)
+    return time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    lines = make_lines(n)
+    sample = lines[:n // 20]
+    batch_time = timed(evaluate_batch, lines)
+    scale = len(lines) / len(sample)
+    tree_time = scale * timed(
+        lambda lines: [compile_formula(line).evaluate() for line in lines],
+        sample)
+    one_pass_time = scale * timed(
+        lambda lines: [evaluate(line) for line in lines], sample)
+    print('%d lines, %d shapes' % (n, len(SHAPES)))
+    for name, elapsed in (('parse + interpret', tree_time),
+                          ('one pass', one_pass_time),
+                          ('batch', batch_time)):
+        print('%-18s %8.3fs  %10.0f lines/s' % (name, elapsed, n / elapsed))
+
+
+if __name__ == '__main__':
+    main()
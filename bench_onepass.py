@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+"""
+one-off expressions: the one-pass Calculator (calc8.evaluate) against
+building and interpreting a tree (calc8.compile_formula(text).evaluate()).
+both sides are this calc8, so the figure is what skipping the tree saves,
+not a comparison with any other version.
+"""
+import random
+import sys
+import timeit
+
+from calc8 import compile_formula, evaluate
+
+
+def make_expression(rng, depth=3):
+    if depth == 0 or rng.random() < 0.3:
+        return str(rng.randint(1, 1000))
+    operands = [make_expression(rng, depth - 1)
+                for _ in range(rng.randint(2, 4))]
+    text = operands[0]
+    for operand in operands[1:]:
+        text += rng.choice([' + ', ' - ', ' * ', ' / ']) + operand
+    return '(' + text + ')' if rng.random() < 0.5 else '-' + text
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(0)
+    texts = [make_expression(rng) for _ in range(n)]
+
+    def tree():
+        for text in texts:
+            try:
+                compile_formula(text).evaluate()
+            except ZeroDivisionError:
+                pass
+
+    def one_pass():
+        for text in texts:
+            try:
+                evaluate(text)
+            except ZeroDivisionError:
+                pass
+
+    tree_time = min(timeit.repeat(tree, number=1, repeat=5))
+    one_pass_time = min(timeit.repeat(one_pass, number=1, repeat=5))
+    print('%d expressions, %d characters on average' % (
+        n, sum(map(len, texts)) // n))
+    print('tree, compile_formula(text).evaluate(): %.3fs' % tree_time)
+    print('one pass, evaluate(text):               %.3fs  '
+          '(%.0f%% less than the tree)' % (
+              one_pass_time, 100 * (1 - one_pass_time / tree_time)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#! /usr/bin/env python3
+"""
+how ThreadPoolEvaluator scales with thread count
+
+run it once with a regular interpreter and once with a free-threaded one
+(e.g. python3.13t) to compare the GIL and no-GIL builds
+"""
+import random
+import sys
+import time
+
+from calc8 import compile_formula
+from pool import ThreadPoolEvaluator
+
+FORMULAS = [
+    'a * (b + c) - d / 7',
+    '(a + b) * (c - d) * (a + 3) - b',
+    'a * a * a + b * b - c * (d + 100) / (a + 1)',
+]
+
+
+def make_jobs(n, seed=0):
+    rng = random.Random(seed)
+    formulas = [compile_formula(text) for text in FORMULAS]
+    return [(rng.choice(formulas),
+             {name: rng.randint(1, 10 ** 6) for name in 'abcd'})
+            for _ in range(n)]
+
+
+def gil_status():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    if is_gil_enabled is None:
+        return 'GIL'
+    return 'GIL' if is_gil_enabled() else 'no GIL'
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    jobs = make_jobs(n)
+    print('%s %s, %d jobs' % (sys.version.split()[0], gil_status(), n))
+    baseline = None
+    for threads in (1, 2, 4, 8, 16):
+        with ThreadPoolEvaluator(threads) as evaluator:
+            start = time.perf_counter()
+            evaluator.evaluate(jobs)
+            elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print('%2d threads: %7.3fs  %5.2fx' % (threads, elapsed,
+                                               baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
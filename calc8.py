@@ -1,20 +1,30 @@
 #! /usr/bin/env python3
 """
+test := or_test ( ? test : test )?
+or_test := and_test ( or and_test )*
+and_test := not_test ( and not_test )*
+not_test := not not_test | comparison
+comparison := expr ( (<|<=|==|!=|>|>=) expr )*
 expr := term ( (+|-) term )*
-term := factor ( (*|/) term) )*
-factor := integer | \( expr \)
+term := factor ( (*|/) factor )*
+factor := integer | name | (+|-) expr | \( test \)
 """
 import operator
+from itertools import zip_longest
 
-(EOF, PLUS, MINUS, MUL, DIV, INTEGER, LPAREN, RPAREN) = (
-    'EOF', 'PLUS', 'MINUS', 'MUL', 'DIV', 'INTEGER', '(', ')')
+(EOF, PLUS, MINUS, MUL, DIV, INTEGER, ID, LPAREN, RPAREN, LT, LE, EQ, NE, GT,
+ GE, AND, OR, NOT, QUESTION, COLON) = (
+    'EOF', 'PLUS', 'MINUS', 'MUL', 'DIV', 'INTEGER', 'ID', '(', ')', '<',
+    '<=', '==', '!=', '>', '>=', 'AND', 'OR', 'NOT', '?', ':')
 
 
 class Token(object):
 
-    def __init__(self, type, value=None):
+    def __init__(self, type, value=None, start=None, end=None):
         self.type = type
         self.value = value
+        self.start = start
+        self.end = end
 
     def __str__(self):
         return '<Token %s%s>' % (self.type,
@@ -25,6 +35,10 @@ class Token(object):
         return self.__str__()
 
 
+class BudgetExceeded(Exception):
+    pass
+
+
 class Lexer(object):
 
     token_type_map = {
@@ -34,6 +48,14 @@ class Lexer(object):
         '/': DIV,
         '(': LPAREN,
         ')': RPAREN,
+        '<': LT,
+        '<=': LE,
+        '==': EQ,
+        '!=': NE,
+        '>': GT,
+        '>=': GE,
+        '?': QUESTION,
+        ':': COLON,
     }
 
     op_value_map = {
@@ -41,10 +63,23 @@ class Lexer(object):
         '-': operator.sub,
         '*': operator.mul,
         '/': operator.truediv,
+        '<': operator.lt,
+        '<=': operator.le,
+        '==': operator.eq,
+        '!=': operator.ne,
+        '>': operator.gt,
+        '>=': operator.ge,
     }
 
-    def __init__(self, text):
+    keywords = {
+        'and': AND,
+        'or': OR,
+        'not': NOT,
+    }
+
+    def __init__(self, text, max_digits=None):
         self.text = text + '\0'
+        self.max_digits = max_digits
 
     def skip_spaces(self, pos):
         while self.text[pos] != '\0' and self.text[pos].isspace():
@@ -58,68 +93,217 @@ class Lexer(object):
         anchor = pos
         while self.text[pos] != '\0' and self.text[pos].isdigit():
             pos += 1
+        if self.max_digits is not None and pos - anchor > self.max_digits:
+            raise BudgetExceeded('integer literal longer than %d digits' %
+                                 self.max_digits)
         return [int(self.text[anchor: pos]), pos]
 
+    def identifier(self, pos):
+        anchor = pos
+        while self.text[pos].isalnum() or self.text[pos] == '_':
+            pos += 1
+        return [self.text[anchor: pos], pos]
+
     @property
     def tokens(self):
         pos = 0
         while self.text[pos] != '\0':
             pos = self.skip_spaces(pos)
             current_char = self.text[pos]
-            if current_char in {'+', '-', '*', '/', '(', ')'}:
-                pos += 1
-                yield Token(self.token_type_map[current_char],
-                            self.op_value_map.get(current_char))
+            anchor = pos
+            # only `<`, `>`, `=` and `!` start two character operators
+            if current_char in self.token_type_map or current_char in '=!':
+                op = self.text[pos:pos + 2]
+                if op not in self.token_type_map:
+                    op = current_char
+                if op not in self.token_type_map:
+                    self.error()
+                pos += len(op)
+                yield Token(self.token_type_map[op],
+                            self.op_value_map.get(op), anchor, pos)
             elif current_char.isdigit():
                 [value, pos] = self.integer(pos)
-                yield Token(INTEGER, value)
+                yield Token(INTEGER, value, anchor, pos)
+            elif current_char.isalpha() or current_char == '_':
+                [name, pos] = self.identifier(pos)
+                if name in self.keywords:
+                    yield Token(self.keywords[name], None, anchor, pos)
+                else:
+                    yield Token(ID, name, anchor, pos)
             else:
                 self.error()
-        yield Token(EOF)
+        yield Token(EOF, None, pos, pos)
 
 
-class Node(object):
-    pass
+class Frozen(object):
+    """
+    positional constructor arguments fill __slots__ in order, after which the
+    instance can't be modified, so it is safe to share between threads
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        if len(values) > len(self.__slots__):
+            raise TypeError('%s takes at most %d arguments (%d given)' % (
+                type(self).__name__, len(self.__slots__), len(values)))
+        for name, value in zip_longest(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, name)
+                                 for name in self.__slots__)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+
+class Node(Frozen):
+    """
+    span is the (start, end) offset of the node in the source text, None
+    unless it comes from a parser asked for spans. nodes are built for every
+    parse, so they set their slots in a plain __init__ instead of Frozen's
+    generic one.
+    """
+
+    __slots__ = ()
 
 
 class Num(Node):
+    __slots__ = ('value', 'span')
 
-    def __init__(self, value):
-        self.value = value
+    def __init__(self, value, span=None):
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'span', span)
 
 
-class BinOp(Node):
+class Var(Node):
+    __slots__ = ('name', 'span')
 
-    def __init__(self, op, left, right):
-        self.op = op
-        self.left = left
-        self.right = right
+    def __init__(self, name, span=None):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'span', span)
 
-    @property
-    def value(self):
-        return self.op(self.left.value, self.right.value)
+
+class Sum(Node):
+    """
+    operands added up left to right, negated[i] tells whether operand i is
+    subtracted instead (negated[0] is always False)
+    """
+
+    __slots__ = ('operands', 'negated', 'span')
+
+    def __init__(self, operands, negated, span=None):
+        object.__setattr__(self, 'operands', operands)
+        object.__setattr__(self, 'negated', negated)
+        object.__setattr__(self, 'span', span)
+
+
+class Product(Node):
+    """
+    operands multiplied left to right, inverted[i] tells whether the result
+    is divided by operand i instead (inverted[0] is always False)
+    """
+
+    __slots__ = ('operands', 'inverted', 'span')
+
+    def __init__(self, operands, inverted, span=None):
+        object.__setattr__(self, 'operands', operands)
+        object.__setattr__(self, 'inverted', inverted)
+        object.__setattr__(self, 'span', span)
 
 
 class UnaryOp(Node):
+    __slots__ = ('op', 'child', 'span')
 
-    def __init__(self, op, child):
+    def __init__(self, op, child, span=None):
+        object.__setattr__(self, 'op', op)
+        object.__setattr__(self, 'child', child)
+        object.__setattr__(self, 'span', span)
 
-        self.op = op
-        self.child = child
 
-    @property
-    def value(self):
-        return self.op(self.child.value)
+class Compare(Node):
+    """
+    operands compared pairwise left to right with ops[i] between operand i
+    and i + 1, like python chains them: True when every comparison holds,
+    evaluated up to the first one which doesn't
+    """
+
+    __slots__ = ('operands', 'ops', 'span')
+
+    def __init__(self, operands, ops, span=None):
+        object.__setattr__(self, 'operands', operands)
+        object.__setattr__(self, 'ops', ops)
+        object.__setattr__(self, 'span', span)
+
+
+class And(Node):
+    """
+    True when all operands are true, evaluated left to right up to the
+    first false one
+    """
+
+    __slots__ = ('operands', 'span')
+
+    def __init__(self, operands, span=None):
+        object.__setattr__(self, 'operands', operands)
+        object.__setattr__(self, 'span', span)
+
+
+class Or(Node):
+    """
+    True when any operand is true, evaluated left to right up to the first
+    true one
+    """
+
+    __slots__ = ('operands', 'span')
+
+    def __init__(self, operands, span=None):
+        object.__setattr__(self, 'operands', operands)
+        object.__setattr__(self, 'span', span)
+
+
+class Cond(Node):
+    """
+    body if test is true else orelse, only one of them is evaluated
+    """
+
+    __slots__ = ('test', 'body', 'orelse', 'span')
+
+    def __init__(self, test, body, orelse, span=None):
+        object.__setattr__(self, 'test', test)
+        object.__setattr__(self, 'body', body)
+        object.__setattr__(self, 'orelse', orelse)
+        object.__setattr__(self, 'span', span)
+
+
+# the default left operand of the rules above expr, they parse it themselves
+# unless factor hands them one it already parsed
+UNPARSED = object()
 
 
 class Parser(object):
+    """
+    nodes only get spans when spans is set, working them out slows down
+    every parse for the few users which point back into the source
+    """
 
-    def __init__(self, lexer):
+    def __init__(self, lexer, max_depth=None, spans=False):
         self.tokens = lexer.tokens
         self.current_token = next(self.tokens)
+        self.previous_end = None
+        # where the left operand factor handed to the rules above expr starts
+        self.left_start = None
+        self.depth = 0
+        self.max_depth = float('inf') if max_depth is None else max_depth
+        self.spans = spans
 
     def eat(self, token_type):
         if self.current_token.type == token_type:
+            self.previous_end = self.current_token.end
             self.current_token = next(self.tokens)
         else:
             self.error()
@@ -127,56 +311,450 @@ class Parser(object):
     def error(self):
         raise Exception("unexpected token: " + str(self.current_token))
 
+    def enter(self):
+        """
+        count one more level of parens, unary or conditional operators, the
+        caller takes it back with self.depth -= 1. refusing deep input here
+        keeps it from running into RecursionError in the parser or in the
+        visitors walking the tree later.
+        """
+        self.depth += 1
+        if self.depth > self.max_depth:
+            raise BudgetExceeded('nesting deeper than %d levels' %
+                                 self.max_depth)
+
+    def span(self, start=None):
+        """
+        span from start (or the current token) up to the last eaten token,
+        None when spans are off
+        """
+        if not self.spans:
+            return None
+        if start is None:
+            return (self.current_token.start, self.current_token.end)
+        return (start, self.previous_end)
+
+    def start(self, left):
+        """
+        where a rule starts which may have been handed its left operand
+        """
+        if left is UNPARSED:
+            return self.current_token.start
+        return self.left_start
+
     def factor(self):
         if self.current_token.type == INTEGER:
-            ret = Num(self.current_token.value)
+            ret = Num(self.current_token.value, self.span())
             self.eat(INTEGER)
+        elif self.current_token.type == ID:
+            ret = Var(self.current_token.value, self.span())
+            self.eat(ID)
         elif self.current_token.type in {PLUS, MINUS}:
             op = {
                 PLUS: operator.pos,
                 MINUS: operator.neg,
             }[self.current_token.type]
+            start = self.current_token.start
             self.eat(self.current_token.type)
-            ret = UnaryOp(op, self.expr())
+            self.enter()
+            ret = UnaryOp(op, self.expr(), self.span(start))
+            self.depth -= 1
         elif self.current_token.type == LPAREN:
+            # plain arithmetic in parens goes straight to expr and only
+            # climbs the boolean rules when more follows, so every level of
+            # nested parens costs three stack frames, not eight
             self.eat(LPAREN)
-            ret = self.expr()
+            self.enter()
+            if self.current_token.type == NOT:
+                ret = self.test()
+            else:
+                start = self.current_token.start
+                ret = self.expr()
+                if self.current_token.type != RPAREN:
+                    self.left_start = start
+                    ret = self.test(ret)
+            self.depth -= 1
             self.eat(RPAREN)
         else:
             self.error()
         return ret
 
     def term(self):
-
-        node = self.factor()
+        start = self.current_token.start
+        operands = [self.factor()]
+        inverted = [False]
         while self.current_token.type in {MUL, DIV}:
-            op = self.current_token.value
+            inverted.append(self.current_token.type == DIV)
             self.eat(self.current_token.type)
-            node = BinOp(op, node, self.factor())
-
-        return node
+            operands.append(self.factor())
+        if len(operands) == 1:
+            return operands[0]
+        return Product(tuple(operands), tuple(inverted), self.span(start))
 
     def expr(self):
-        node = self.term()
+        start = self.current_token.start
+        operands = [self.term()]
+        negated = [False]
         while self.current_token.type in {PLUS, MINUS}:
-            op = self.current_token.value
+            negated.append(self.current_token.type == MINUS)
+            self.eat(self.current_token.type)
+            operands.append(self.term())
+        if len(operands) == 1:
+            return operands[0]
+        return Sum(tuple(operands), tuple(negated), self.span(start))
+
+    def comparison(self, left=UNPARSED):
+        start = self.start(left)
+        operands = [self.expr() if left is UNPARSED else left]
+        ops = []
+        while self.current_token.type in {LT, LE, EQ, NE, GT, GE}:
+            ops.append(self.current_token.value)
             self.eat(self.current_token.type)
-            node = BinOp(op, node, self.term())
+            operands.append(self.expr())
+        if not ops:
+            return operands[0]
+        return Compare(tuple(operands), tuple(ops), self.span(start))
+
+    def not_test(self, left=UNPARSED):
+        if left is UNPARSED and self.current_token.type == NOT:
+            start = self.current_token.start
+            self.eat(NOT)
+            self.enter()
+            node = UnaryOp(operator.not_, self.not_test(), self.span(start))
+            self.depth -= 1
+            return node
+        return self.comparison(left)
+
+    def and_test(self, left=UNPARSED):
+        start = self.start(left)
+        operands = [self.not_test(left)]
+        while self.current_token.type == AND:
+            self.eat(AND)
+            operands.append(self.not_test())
+        if len(operands) == 1:
+            return operands[0]
+        return And(tuple(operands), self.span(start))
+
+    def or_test(self, left=UNPARSED):
+        start = self.start(left)
+        operands = [self.and_test(left)]
+        while self.current_token.type == OR:
+            self.eat(OR)
+            operands.append(self.and_test())
+        if len(operands) == 1:
+            return operands[0]
+        return Or(tuple(operands), self.span(start))
+
+    def test(self, left=UNPARSED):
+        start = self.start(left)
+        node = self.or_test(left)
+        if self.current_token.type == QUESTION:
+            self.eat(QUESTION)
+            self.enter()
+            body = self.test()
+            self.eat(COLON)
+            node = Cond(node, body, self.test(), self.span(start))
+            self.depth -= 1
         return node
 
+    def parse(self):
+        """
+        the whole text has to be one expression, trailing tokens are an
+        error
+        """
+        node = self.test()
+        if self.current_token.type != EOF:
+            self.error()
+        return node
 
-class Interpreter(object):
 
-    def __init__(self, tree):
-        self.__tree = tree
+class NodeVisitor(object):
+    """
+    visit() dispatches on the node class to visit_<class name>, the method
+    found for a class is cached per visitor class
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.methods = {}
 
     def visit(self, node):
+        try:
+            method = self.methods[type(node)]
+        except KeyError:
+            method = getattr(type(self), 'visit_' + type(node).__name__)
+            self.methods[type(node)] = method
+        return method(self, node)
+
+
+class Interpreter(NodeVisitor):
+
+    def __init__(self, tree, bindings=None):
+        self.__tree = tree
+        self.bindings = {} if bindings is None else bindings
+
+    def error(self, node):
+        raise Exception('unbound variable: ' + node.name)
+
+    def visit_Num(self, node):
         return node.value
 
+    def visit_Var(self, node):
+        try:
+            return self.bindings[node.name]
+        except KeyError:
+            self.error(node)
+
+    def visit_Sum(self, node):
+        values = map(self.visit, node.operands)
+        result = next(values)
+        for value, negated in zip(values, node.negated[1:]):
+            if negated:
+                result = result - value
+            else:
+                result = result + value
+        return result
+
+    def visit_Product(self, node):
+        values = map(self.visit, node.operands)
+        result = next(values)
+        for value, inverted in zip(values, node.inverted[1:]):
+            if inverted:
+                result = result / value
+            else:
+                result = result * value
+        return result
+
+    def visit_UnaryOp(self, node):
+        return node.op(self.visit(node.child))
+
+    def visit_Compare(self, node):
+        left = self.visit(node.operands[0])
+        for op, operand in zip(node.ops, node.operands[1:]):
+            right = self.visit(operand)
+            if not op(left, right):
+                return False
+            left = right
+        return True
+
+    def visit_And(self, node):
+        for operand in node.operands:
+            if not self.visit(operand):
+                return False
+        return True
+
+    def visit_Or(self, node):
+        for operand in node.operands:
+            if self.visit(operand):
+                return True
+        return False
+
+    def visit_Cond(self, node):
+        if self.visit(node.test):
+            return self.visit(node.body)
+        return self.visit(node.orelse)
+
     def interpret(self):
         return self.visit(self.__tree)
 
 
+class Formula(Frozen):
+    """
+    a parsed expression, evaluation state lives in a fresh Interpreter per
+    call so one formula can be evaluated from many threads at once
+    """
+
+    __slots__ = ('text', 'tree')
+
+    def evaluate(self, bindings=None):
+        return Interpreter(self.tree, bindings).interpret()
+
+
+def compile_formula(text, max_digits=None, max_depth=None, spans=False):
+    """
+    raises BudgetExceeded on a literal of more than max_digits digits or
+    nesting deeper than max_depth, before paying for either
+    """
+    return Formula(text, Parser(Lexer(text, max_digits), max_depth,
+                                spans).parse())
+
+
+SKIPPED = object()
+
+
+class Calculator(Parser):
+    """
+    evaluates while parsing like calc6 does, without building a tree, for
+    expressions evaluated only once. the first evaluation error is kept and
+    parsing goes on, so a later syntax error still wins just like it does
+    with Parser and Interpreter. nothing is evaluated while failure is set,
+    which is also how the operands the Interpreter wouldn't visit are
+    skipped.
+    """
+
+    def __init__(self, lexer, bindings=None, max_depth=None):
+        super().__init__(lexer, max_depth)
+        self.bindings = {} if bindings is None else bindings
+        self.failure = None
+
+    def factor(self):
+        token = self.current_token
+        if token.type == INTEGER:
+            self.eat(INTEGER)
+            return token.value
+        elif token.type == ID:
+            self.eat(ID)
+            if self.failure is None:
+                try:
+                    return self.bindings[token.value]
+                except KeyError:
+                    self.failure = Exception('unbound variable: ' +
+                                             token.value)
+        elif token.type in {PLUS, MINUS}:
+            self.eat(token.type)
+            self.enter()
+            value = self.expr()
+            self.depth -= 1
+            if self.failure is None:
+                try:
+                    if token.type == PLUS:
+                        return operator.pos(value)
+                    return operator.neg(value)
+                except Exception as e:
+                    self.failure = e
+        elif token.type == LPAREN:
+            self.eat(LPAREN)
+            self.enter()
+            if self.current_token.type == NOT:
+                value = self.test()
+            else:
+                value = self.expr()
+                if self.current_token.type != RPAREN:
+                    value = self.test(value)
+            self.depth -= 1
+            self.eat(RPAREN)
+            return value
+        else:
+            self.error()
+
+    def skip(self, rule):
+        failure = self.failure
+        if failure is None:
+            self.failure = SKIPPED
+        rule()
+        self.failure = failure
+
+    def term(self):
+        result = self.factor()
+        while self.current_token.type in {MUL, DIV}:
+            inverted = self.current_token.type == DIV
+            self.eat(self.current_token.type)
+            value = self.factor()
+            if self.failure is None:
+                try:
+                    result = result / value if inverted else result * value
+                except Exception as e:
+                    self.failure = e
+        return result
+
+    def expr(self):
+        result = self.term()
+        while self.current_token.type in {PLUS, MINUS}:
+            negated = self.current_token.type == MINUS
+            self.eat(self.current_token.type)
+            value = self.term()
+            if self.failure is None:
+                try:
+                    result = result - value if negated else result + value
+                except Exception as e:
+                    self.failure = e
+        return result
+
+    def comparison(self, left=UNPARSED):
+        if left is UNPARSED:
+            left = self.expr()
+        if self.current_token.type not in {LT, LE, EQ, NE, GT, GE}:
+            return left
+        result = True
+        while self.current_token.type in {LT, LE, EQ, NE, GT, GE}:
+            op = self.current_token.value
+            self.eat(self.current_token.type)
+            if not result:
+                self.skip(self.expr)
+                continue
+            right = self.expr()
+            if self.failure is None:
+                try:
+                    result = bool(op(left, right))
+                except Exception as e:
+                    self.failure = e
+            left = right
+        return result
+
+    def not_test(self, left=UNPARSED):
+        if left is UNPARSED and self.current_token.type == NOT:
+            self.eat(NOT)
+            self.enter()
+            result = not self.not_test()
+            self.depth -= 1
+            return result
+        return self.comparison(left)
+
+    def and_test(self, left=UNPARSED):
+        result = self.not_test(left)
+        if self.current_token.type != AND:
+            return result
+        result = bool(result)
+        while self.current_token.type == AND:
+            self.eat(AND)
+            if result:
+                result = bool(self.not_test())
+            else:
+                self.skip(self.not_test)
+        return result
+
+    def or_test(self, left=UNPARSED):
+        result = self.and_test(left)
+        if self.current_token.type != OR:
+            return result
+        result = bool(result)
+        while self.current_token.type == OR:
+            self.eat(OR)
+            if result:
+                self.skip(self.and_test)
+            else:
+                result = bool(self.and_test())
+        return result
+
+    def test(self, left=UNPARSED):
+        result = self.or_test(left)
+        if self.current_token.type == QUESTION:
+            self.eat(QUESTION)
+            self.enter()
+            if result:
+                result = self.test()
+                self.eat(COLON)
+                self.skip(self.test)
+            else:
+                self.skip(self.test)
+                self.eat(COLON)
+                result = self.test()
+            self.depth -= 1
+        return result
+
+    def parse(self):
+        result = self.test()
+        if self.current_token.type != EOF:
+            self.error()
+        if self.failure is not None:
+            raise self.failure
+        return result
+
+
+def evaluate(text, bindings=None):
+    return Calculator(Lexer(text), bindings).parse()
+
+
 def main():
 
     while True:
@@ -188,10 +766,7 @@ def main():
         if not text:
             continue
 
-        lexer = Lexer(text)
-        tree = Parser(lexer).expr()
-        interpreter = Interpreter(tree)
-        print(interpreter.interpret())
+        print(evaluate(text))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+"""
+canonical normal form and fingerprints of calc8 trees
+
+`2+3*4`, `3*4+2` and `((2)+(4*3))` canonicalize to the same tree. Sum and
+Product operands are flattened and sorted only as far as the arithmetic is
+exact on integers, from the first float (a division) on the order is kept
+because float addition and multiplication don't associate. they do commute
+though, so the first two operands are still sorted unless both may raise.
+variables may be bound to floats or not at all, so they are only reordered
+beyond that when exact_vars is set (either way variables are assumed to be
+numbers, not booleans). `and`/`or` and comparisons keep their order since
+it decides which operands get evaluated.
+"""
+import hashlib
+import operator
+
+from calc8 import (And, Compare, Cond, Interpreter, Lexer, NodeVisitor, Num,
+                   Or, Parser, Product, Sum, UnaryOp)
+
+op_symbol_map = {value: key for key, value in Lexer.op_value_map.items()}
+# kinds of values which add up and multiply exactly in any order
+EXACT = {'int', 'bool'}
+
+
+class Canonicalizer(NodeVisitor):
+    """
+    visit() returns (node, key, kind), key is the canonical serialization
+    used both to order operands and as the fingerprint input. kind is 'int',
+    'bool', 'float' (any number which isn't known to be an int) or None when
+    it depends on the input. 'int' and 'bool' also promise the evaluation
+    can't raise, so moving it around can't change which error comes first.
+    """
+
+    def __init__(self, exact_vars=False):
+        self.exact_vars = exact_vars
+        # id -> (node, key, kind) of every canonical node handed out, the
+        # node is kept so its id can't be reused while flattening
+        self.keys = {}
+
+    def visit(self, node):
+        node, key, kind = super().visit(node)
+        self.keys[id(node)] = (node, key, kind)
+        return node, key, kind
+
+    def key(self, node):
+        return self.keys[id(node)][1]
+
+    def visit_Num(self, node):
+        kind = {int: 'int', bool: 'bool', float: 'float'}.get(type(node.value))
+        return node, repr(node.value), kind
+
+    def visit_Var(self, node):
+        return node, node.name, 'int' if self.exact_vars else 'float'
+
+    def visit_UnaryOp(self, node):
+        child, key, kind = self.visit(node.child)
+        if node.op is operator.not_:
+            return (UnaryOp(node.op, child), '(not %s)' % key,
+                    'bool' if kind in EXACT else None)
+        # +True and --True are 1, only numbers lose their unary operators
+        if node.op is operator.pos and kind in {'int', 'float'}:
+            return child, key, kind
+        if node.op is operator.neg and isinstance(child, UnaryOp) and \
+                child.op is operator.neg:
+            grandchild, grandchild_key, grandchild_kind = \
+                self.keys[id(child.child)]
+            if grandchild_kind in {'int', 'float'}:
+                return grandchild, grandchild_key, grandchild_kind
+        return (UnaryOp(node.op, child),
+                '(%s %s)' % ('+' if node.op is operator.pos else '-', key),
+                'int' if kind in EXACT else 'float')
+
+    def visit_Compare(self, node):
+        operands, keys, kinds = zip(*map(self.visit, node.operands))
+        return (Compare(operands, node.ops),
+                '(%s)' % ' '.join([op_symbol_map[op] for op in node.ops] +
+                                  list(keys)),
+                'bool' if set(kinds) <= EXACT else None)
+
+    def visit_And(self, node):
+        return self.logical(And, 'and', node.operands)
+
+    def visit_Or(self, node):
+        return self.logical(Or, 'or', node.operands)
+
+    def logical(self, cls, name, operands):
+        """
+        nested chains of the same operator are spliced in, that evaluates
+        the same operands in the same order
+        """
+        children = []
+        kinds = set()
+        for operand in operands:
+            child, _, kind = self.visit(operand)
+            kinds.add(kind)
+            if isinstance(child, cls):
+                children.extend(child.operands)
+            else:
+                children.append(child)
+        return (cls(tuple(children)),
+                '(%s %s)' % (name, ' '.join(map(self.key, children))),
+                'bool' if kinds <= EXACT else None)
+
+    def visit_Cond(self, node):
+        test, test_key, test_kind = self.visit(node.test)
+        body, body_key, body_kind = self.visit(node.body)
+        orelse, orelse_key, orelse_kind = self.visit(node.orelse)
+        kind = body_kind if body_kind == orelse_kind else None
+        if kind in EXACT and test_kind not in EXACT:
+            kind = None
+        return (Cond(test, body, orelse),
+                '(? %s %s %s)' % (test_key, body_key, orelse_key), kind)
+
+    def visit_Sum(self, node):
+        return self.reduce(Sum, node.operands, node.negated, self.terms)
+
+    def visit_Product(self, node):
+        return self.reduce(Product, node.operands, node.inverted,
+                           self.factors)
+
+    def reduce(self, cls, operands, flags, flatten):
+        """
+        the leading run of exact operands is flattened and sorted since
+        integers add up and multiply to the same result in any order, the
+        rest keeps its order. a nested chain up front is spliced in either
+        way, that doesn't change the order of the operations. the first two
+        operands commute even as floats, they are swapped into order unless
+        that could change which of them raises first.
+        """
+        children = [self.visit(operand) for operand in operands]
+        run = 0
+        for (_, _, kind), flag in zip(children, flags):
+            if kind not in EXACT or (flag and cls is Product):
+                break
+            run += 1
+        items = []
+        for (child, _, _), flag in zip(children[:run], flags):
+            flatten(child, flag, items)
+        items.sort(key=operator.itemgetter(0, 1))
+        for (child, key, _), flag in zip(children[run:], flags[run:]):
+            items.append((key, flag, child))
+        if run == 0 and isinstance(items[0][2], cls):
+            nested = items.pop(0)[2]
+            items[:0] = [(self.key(operand), flag, operand)
+                         for operand, flag in zip(nested.operands,
+                                                  self.flags(nested))]
+        if len(items) > 1 and not items[1][1] and \
+                items[1][:2] < items[0][:2] and \
+                not (self.raises(items[0][2]) and self.raises(items[1][2])):
+            items[0], items[1] = items[1], items[0]
+
+        key, flag, first = items[0]
+        if flag:
+            first = UnaryOp(operator.neg, first)
+            self.keys[id(first)] = (first, '(- %s)' % key, 'int')
+        symbol, inverse = {Sum: ('+', '-'), Product: ('*', '/')}[cls]
+        node = cls((first, ) + tuple(node for _, _, node in items[1:]),
+                   (False, ) + tuple(flag for _, flag, _ in items[1:]))
+        key = '(%s %s)' % (symbol, ' '.join(
+            '(%s %s)' % (inverse, key) if flag else key
+            for key, flag, _ in items))
+        return node, key, 'int' if run == len(children) else 'float'
+
+    def raises(self, node):
+        """
+        whether evaluating a canonical node may raise, exact nodes and
+        literals can't. a variable may be unbound unless exact_vars is set.
+        """
+        if self.keys[id(node)][2] in EXACT or isinstance(node, Num):
+            return False
+        if isinstance(node, UnaryOp):
+            return self.raises(node.child)
+        if isinstance(node, (Compare, And, Or)):
+            return any(map(self.raises, node.operands))
+        if isinstance(node, Cond):
+            return any(map(self.raises, (node.test, node.body, node.orelse)))
+        return True
+
+    def flags(self, node):
+        return node.negated if isinstance(node, Sum) else node.inverted
+
+    def terms(self, node, negated, out):
+        if isinstance(node, Sum):
+            for operand, flag in zip(node.operands, node.negated):
+                self.terms(operand, negated ^ flag, out)
+        elif isinstance(node, UnaryOp) and node.op is operator.neg:
+            self.terms(node.child, not negated, out)
+        else:
+            out.append((self.key(node), negated, node))
+        return out
+
+    def factors(self, node, inverted, out):
+        if isinstance(node, Product):
+            for operand in node.operands:
+                self.factors(operand, inverted, out)
+        else:
+            out.append((self.key(node), inverted, node))
+        return out
+
+
+def canonicalize(tree, exact_vars=False):
+    return Canonicalizer(exact_vars).visit(tree)[0]
+
+
+def fingerprint(tree, exact_vars=False):
+    key = Canonicalizer(exact_vars).visit(tree)[1]
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def evaluate_distinct(texts, bindings=None, exact_vars=False):
+    """
+    evaluate every text, but each distinct formula only once
+    """
+    results = []
+    cache = {}
+    for text in texts:
+        tree = Parser(Lexer(text)).parse()
+        key = fingerprint(tree, exact_vars)
+        if key not in cache:
+            cache[key] = Interpreter(tree, bindings).interpret()
+        results.append(cache[key])
+    return results
@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+"""
+keep pathological input from tying up a worker
+
+calc8.compile_formula() refuses overlong integer literals and deep nesting
+when given max_digits and max_depth. estimate() sizes a parsed tree up
+front (node count, depth and how many bits its integers may grow to) for
+admission control, BudgetedInterpreter aborts evaluation with
+BudgetExceeded once a step or integer size limit is hit. the plain
+Interpreter is untouched, so unbudgeted evaluation costs nothing.
+"""
+import operator
+
+from calc8 import BudgetExceeded, Frozen, Interpreter, NodeVisitor
+
+
+class Cost(Frozen):
+    """
+    bits is an upper bound of the integer result size, None when the result
+    is a float (whose size is bounded anyway)
+    """
+
+    __slots__ = ('nodes', 'depth', 'bits')
+
+    def __repr__(self):
+        return '<Cost nodes=%d depth=%d bits=%s>' % (self.nodes, self.depth,
+                                                     self.bits)
+
+
+class CostEstimator(NodeVisitor):
+
+    def __init__(self, var_bits=64):
+        self.var_bits = var_bits
+
+    def combine(self, bits, *children):
+        return Cost(1 + sum(child.nodes for child in children),
+                    1 + max(child.depth for child in children), bits)
+
+    def visit_Num(self, node):
+        if isinstance(node.value, int):
+            return Cost(1, 1, max(node.value.bit_length(), 1))
+        return Cost(1, 1, None)
+
+    def visit_Var(self, node):
+        return Cost(1, 1, self.var_bits)
+
+    def visit_Sum(self, node):
+        operands = [self.visit(operand) for operand in node.operands]
+        if any(operand.bits is None for operand in operands):
+            bits = None
+        else:
+            bits = max(operand.bits for operand in operands) + \
+                (len(operands) - 1).bit_length()
+        return self.combine(bits, *operands)
+
+    def visit_Product(self, node):
+        operands = [self.visit(operand) for operand in node.operands]
+        if any(node.inverted) or \
+                any(operand.bits is None for operand in operands):
+            bits = None
+        else:
+            bits = sum(operand.bits for operand in operands)
+        return self.combine(bits, *operands)
+
+    def visit_UnaryOp(self, node):
+        child = self.visit(node.child)
+        if node.op is operator.not_:
+            return self.combine(1, child)
+        return self.combine(child.bits, child)
+
+    def visit_Compare(self, node):
+        return self.combine(1, *map(self.visit, node.operands))
+
+    def visit_And(self, node):
+        return self.combine(1, *map(self.visit, node.operands))
+
+    def visit_Or(self, node):
+        return self.combine(1, *map(self.visit, node.operands))
+
+    def visit_Cond(self, node):
+        test = self.visit(node.test)
+        body = self.visit(node.body)
+        orelse = self.visit(node.orelse)
+        bits = [branch.bits for branch in (body, orelse)
+                if branch.bits is not None]
+        return self.combine(max(bits, default=None), test, body, orelse)
+
+
+def estimate(tree, var_bits=64):
+    return CostEstimator(var_bits).visit(tree)
+
+
+def check(tree, max_nodes=None, max_depth=None, max_bits=None, var_bits=64):
+    cost = estimate(tree, var_bits)
+    for name, limit in (('nodes', max_nodes), ('depth', max_depth),
+                        ('bits', max_bits)):
+        value = getattr(cost, name)
+        if limit is not None and value is not None and value > limit:
+            raise BudgetExceeded('%s %d exceeds %d' % (name, value, limit))
+    return cost
+
+
+class BudgetedInterpreter(Interpreter):
+
+    def __init__(self, tree, bindings=None, max_steps=None, max_bits=None):
+        super().__init__(tree, bindings)
+        self.steps = 0
+        self.max_steps = float('inf') if max_steps is None else max_steps
+        self.max_bits = float('inf') if max_bits is None else max_bits
+
+    def check_bits(self, value):
+        if type(value) is int and value.bit_length() > self.max_bits:
+            raise BudgetExceeded('integer of %d bits exceeds %d' %
+                                 (value.bit_length(), self.max_bits))
+        return value
+
+    def visit(self, node):
+        self.steps += 1
+        if self.steps > self.max_steps:
+            raise BudgetExceeded('more than %d steps' % self.max_steps)
+        return super().visit(node)
+
+    def visit_Num(self, node):
+        return self.check_bits(node.value)
+
+    def visit_Var(self, node):
+        return self.check_bits(super().visit_Var(node))
+
+    def visit_Sum(self, node):
+        # every operand is within budget, so no partial sum can get far out
+        return self.check_bits(super().visit_Sum(node))
+
+    def visit_Product(self, node):
+        values = map(self.visit, node.operands)
+        result = next(values)
+        for value, inverted in zip(values, node.inverted[1:]):
+            if inverted:
+                result = result / value
+                continue
+            # refuse a big multiplication before paying for it
+            if type(result) is int and type(value) is int and \
+                    result.bit_length() + value.bit_length() > \
+                    self.max_bits + 1:
+                raise BudgetExceeded('product of %d and %d bit integers '
+                                     'exceeds %d bits' % (
+                                         result.bit_length(),
+                                         value.bit_length(), self.max_bits))
+            result = self.check_bits(result * value)
+        return result
+
+
+def evaluate(formula, bindings=None, max_steps=None, max_bits=None):
+    return BudgetedInterpreter(formula.tree, bindings, max_steps,
+                               max_bits).interpret()
@@ -0,0 +1,613 @@
+#! /usr/bin/env python3
+"""
+differential fuzzing of the calculators and a search for slow inputs
+
+fuzz() generates random texts from the calc5, calc6 or calc8 grammar (with
+now and then a character mangled), runs every text through every engine
+whose grammar covers it and compares the outcome, result type and value or
+error type, with calc8's tree interpreter. error messages are compared too
+between engines built on calc8. every disagreement is shrunk by delta
+debugging to a short text that still disagrees the same way, except for
+the known differences of the older calculators, which are only counted.
+
+search() hill climbs towards texts which cost the most time or memory per
+byte in one stage of calc8 (lexer, parser, interpreter or the one-pass
+calculator) and reports how much worse that is than a plain `1+1+...+1`
+of the same size.
+
+usage: fuzz.py [COUNT [SEED [ENGINE,...]]]
+       fuzz.py search time|memory [lex|parse|evaluate|onepass [ROUNDS [SEED]]]
+"""
+from concurrent.futures import ProcessPoolExecutor
+import random
+import sys
+from time import perf_counter
+import tracemalloc
+
+import calc5
+import calc6
+import calc7
+from calc8 import (DIV, EOF, INTEGER, LPAREN, MINUS, MUL, PLUS, RPAREN,
+                   Frozen, Interpreter, Lexer, Parser, compile_formula,
+                   evaluate)
+from canon import canonicalize
+import cost
+import parallel
+from pool import ThreadPoolEvaluator
+from profiler import ProfilingInterpreter
+from specialize import specialize
+
+try:
+    import batch
+except ImportError:
+    batch = None
+
+# every grammar includes the ones before it
+GRAMMARS = ('calc5', 'calc6', 'calc8')
+BINDINGS = {'x': 3, 'y': -7, 'z': 0.5, 'big': 10 ** 20, 'huge': 1e300}
+# names the generator uses, `u` is never bound
+NAMES = sorted(BINDINGS) + ['u']
+# (engine, Mismatch.kind) of the differences of the older calculators which
+# are left alone
+KNOWN = {
+    # calc5 and calc6 evaluate while parsing, so a division by zero raises
+    # before a syntax error further on
+    ('calc5', ('error', 'Exception', 'error', 'ZeroDivisionError')),
+    ('calc6', ('error', 'Exception', 'error', 'ZeroDivisionError')),
+    # calc7's Parser has no error(), syntax errors raise AttributeError
+    ('calc7', ('error', 'Exception', 'error', 'AttributeError')),
+}
+# calc6 and calc7 lex `*` as PLUS, so products bind like sums, which can
+# change any value and where a division by zero happens. only texts with a
+# `*` run into it.
+PRECEDENCE = {expected + got
+              for expected in [('value', 'int'), ('value', 'float'),
+                               ('error', 'ZeroDivisionError')]
+              for got in [('value', 'int'), ('value', 'float'),
+                          ('error', 'ZeroDivisionError')]
+              if expected != got or expected[0] == 'value'}
+# what the search mode splices into texts
+SNIPPETS = ['(', ')', '-', '+', '*', '/', ' ', '0', '9', '99999999', 'x',
+            'z', '<', '==', ' and ', ' or ', 'not ', ' ? ', ' : ']
+
+
+def known(mismatch):
+    """
+    whether mismatch is one of the KNOWN differences, trailing tokens the
+    older calculators ignore, or the precedence bug of calc6 and calc7 on a
+    text with a `*`
+    """
+    if (mismatch.engine, mismatch.kind) in KNOWN:
+        return True
+    # the older calculators stop at the first token they can't go on with
+    # and return what they have, calc8 rejects trailing tokens
+    if mismatch.engine in {'calc5', 'calc6', 'calc7'} and \
+            mismatch.kind[:2] == ('error', 'Exception') and \
+            trailing(mismatch.text):
+        return True
+    return mismatch.engine in {'calc6', 'calc7'} and '*' in mismatch.text \
+        and mismatch.kind in PRECEDENCE
+
+
+def trailing(text):
+    """
+    whether calc8 parses an expression off the start of text which isn't
+    all of it
+    """
+    parser = Parser(Lexer(text))
+    try:
+        parser.test()
+    except Exception:
+        return False
+    return parser.current_token.type != EOF
+
+
+def grammar(text):
+    """
+    the first of GRAMMARS covering every token of text up to where it stops
+    lexing. a text outside the older grammars may be valid in calc8 while
+    calc5 or calc6 reject it, so they must not be compared on it.
+    """
+    found = GRAMMARS[0]
+    previous = None
+    try:
+        for token in Lexer(text).tokens:
+            if token.type in {PLUS, MINUS} and \
+                    previous in {None, PLUS, MINUS, MUL, DIV, LPAREN}:
+                return 'calc8'
+            if token.type in {LPAREN, RPAREN}:
+                found = 'calc6'
+            elif token.type not in {INTEGER, PLUS, MINUS, MUL, DIV, EOF}:
+                return 'calc8'
+            previous = token.type
+    except Exception:
+        pass
+    return found
+
+
+class Generator(object):
+    """
+    random texts of one of GRAMMARS. shape() writes integer literals as `#`,
+    fill() replaces them, so one shape can be filled in several times for
+    the engines that group texts by shape.
+    """
+
+    def __init__(self, rng, grammar, max_depth=4):
+        self.rng = rng
+        self.grammar = grammar
+        self.max_depth = max_depth
+
+    def shape(self):
+        text = self.test(self.max_depth)
+        if self.grammar == 'calc8' and self.rng.random() < 0.05:
+            text = ' ' + text
+        return text
+
+    def fill(self, shape):
+        return ''.join(self.literal() if char == '#' else char
+                       for char in shape)
+
+    def literal(self):
+        return self.rng.choice([
+            '0', '1', '2', '7',
+            str(self.rng.randint(0, 1000)),
+            str(self.rng.randint(0, 2 ** 53)),
+            '9' * self.rng.randint(16, 40),
+        ])
+
+    def corrupt(self, text, chance=0.05):
+        """
+        now and then delete, insert or duplicate a character
+        """
+        if not text or self.rng.random() >= chance:
+            return text
+        pos = self.rng.randrange(len(text))
+        return self.rng.choice([
+            text[:pos] + text[pos + 1:],
+            text[:pos] + self.rng.choice('()+-*/ 0x?:<') + text[pos:],
+            text[:pos] + text[pos] + text[pos:],
+        ])
+
+    def space(self):
+        return self.rng.choice(['', '', ' '])
+
+    def chain(self, item, ops, depth, chance):
+        text = item(depth)
+        while depth and self.rng.random() < chance:
+            op = self.rng.choice(ops)
+            if op.isalpha():
+                op = ' %s ' % op
+            else:
+                op = self.space() + op + self.space()
+            text += op + item(depth - 1)
+        return text
+
+    def test(self, depth):
+        if self.grammar != 'calc8':
+            return self.expr(depth)
+        text = self.or_test(depth)
+        if depth and self.rng.random() < 0.1:
+            text += ' ? %s : %s' % (self.test(depth - 1),
+                                    self.test(depth - 1))
+        return text
+
+    def or_test(self, depth):
+        return self.chain(self.and_test, ['or'], depth, 0.1)
+
+    def and_test(self, depth):
+        return self.chain(self.not_test, ['and'], depth, 0.1)
+
+    def not_test(self, depth):
+        if depth and self.rng.random() < 0.05:
+            return 'not ' + self.not_test(depth - 1)
+        return self.comparison(depth)
+
+    def comparison(self, depth):
+        return self.chain(self.expr, ['<', '<=', '==', '!=', '>', '>='],
+                          min(depth, 1), 0.15)
+
+    def expr(self, depth):
+        return self.chain(self.term, ['+', '-'], depth, 0.5)
+
+    def term(self, depth):
+        return self.chain(self.factor, ['*', '/'], depth, 0.4)
+
+    def factor(self, depth):
+        choices = ['#', '#', '#']
+        if depth and self.grammar != 'calc5':
+            choices += ['(', '(']
+        if self.grammar == 'calc8':
+            choices += ['name'] + ['unary'] * bool(depth)
+        choice = self.rng.choice(choices)
+        if choice == '(':
+            return '(' + self.space() + self.test(depth - 1) + \
+                self.space() + ')'
+        if choice == 'name':
+            return self.rng.choice(NAMES)
+        if choice == 'unary':
+            return self.rng.choice('+-') + self.space() + \
+                self.expr(depth - 1)
+        return choice
+
+
+class Engine(Frozen):
+    """
+    run(texts, bindings) returns the outcome of every text. messages tells
+    whether its error messages are supposed to match calc8's.
+    """
+
+    __slots__ = ('name', 'grammar', 'run', 'messages')
+
+
+class Mismatch(Frozen):
+
+    __slots__ = ('engine', 'text', 'expected', 'got')
+
+    @property
+    def kind(self):
+        """
+        what went wrong, without the values
+        """
+        return self.expected[:2] + self.got[:2]
+
+    def __str__(self):
+        return '%s: %r\n  calc8: %s\n  %s: %s' % (
+            self.engine, self.text, describe(self.expected), self.engine,
+            describe(self.got))
+
+
+def outcome(function, *args):
+    """
+    ('value', type name, repr) or ('error', exception name, message)
+    """
+    try:
+        value = function(*args)
+    except Exception as e:
+        return ('error', type(e).__name__, str(e))
+    return ('value', type(value).__name__, repr(value))
+
+
+def describe(outcome):
+    kind, name, detail = outcome
+    if kind == 'error':
+        return '%s(%r)' % (name, detail)
+    return '%s %s' % (name, detail)
+
+
+def same(expected, got, messages=True):
+    if expected[0] == 'error' and not messages:
+        return expected[:2] == got[:2]
+    return expected == got
+
+
+def each(function):
+    return lambda texts, bindings: [outcome(function, text, bindings)
+                                    for text in texts]
+
+
+def together(function):
+    """
+    for engines taking the whole list of texts at once and raising the
+    first error, after an error every text is run on its own
+    """
+    def run(texts, bindings):
+        try:
+            values = function(texts, bindings)
+        except Exception:
+            return [outcome(lambda text: function([text], bindings)[0], text)
+                    for text in texts]
+        return [outcome(lambda: value) for value in values]
+    return run
+
+
+def engines(processes, threads):
+    """
+    calc8's tree interpreter, which everything is compared with, and every
+    other engine. parallel hands its pieces to the processes executor, pool
+    jobs go to the threads ThreadPoolEvaluator.
+    """
+    known = sorted(BINDINGS)[::2]
+
+    def tree(text):
+        return Parser(Lexer(text)).parse()
+
+    found = [
+        Engine('calc8', 'calc8', each(
+            lambda text, bindings: compile_formula(text).evaluate(bindings)),
+            True),
+        Engine('calc5', 'calc5', each(
+            lambda text, bindings: calc5.Interpreter(text).expr()), False),
+        Engine('calc6', 'calc6', each(
+            lambda text, bindings: calc6.Interpreter(text).expr()), False),
+        Engine('calc7', 'calc6', each(
+            lambda text, bindings: calc7.Interpreter(
+                calc7.Parser(calc7.Lexer(text)).expr()).interpret()), False),
+        Engine('onepass', 'calc8', each(evaluate), True),
+        Engine('budgeted', 'calc8', each(
+            lambda text, bindings: cost.evaluate(compile_formula(text),
+                                                 bindings)), True),
+        Engine('profiler', 'calc8', each(
+            lambda text, bindings: ProfilingInterpreter(
+                tree(text), bindings).interpret()), True),
+        Engine('canon', 'calc8', each(
+            lambda text, bindings: Interpreter(
+                canonicalize(tree(text)), bindings).interpret()), True),
+        Engine('specialize', 'calc8', each(
+            lambda text, bindings: Interpreter(specialize(tree(text), {
+                name: bindings[name] for name in known
+                if name in bindings}), bindings).interpret()), True),
+        Engine('parallel', 'calc8', each(
+            lambda text, bindings: parallel.evaluate(
+                text, bindings, 2, 0, processes)), True),
+        Engine('pool', 'calc8', together(
+            lambda texts, bindings: threads.evaluate(
+                [(compile_formula(text), bindings) for text in texts])),
+            True),
+    ]
+    if batch is not None:
+        found.append(Engine('batch', 'calc8', together(
+            lambda texts, bindings: batch.evaluate_batch(texts, bindings,
+                                                         min_group=1)),
+            True))
+    return found
+
+
+def compare(engine, reference, text, bindings):
+    """
+    a Mismatch when engine and reference disagree on text, else None
+    """
+    expected = reference.run([text], bindings)[0]
+    got = engine.run([text], bindings)[0]
+    if same(expected, got, engine.messages):
+        return None
+    return Mismatch(engine.name, text, expected, got)
+
+
+def minimize(text, failing):
+    """
+    delta debugging: drop ever smaller chunks of text as long as the rest
+    still fails, down to single characters
+    """
+    granularity = 2
+    while len(text) >= 2:
+        size = -(-len(text) // granularity)
+        for start in range(0, len(text), size):
+            candidate = text[:start] + text[start + size:]
+            if failing(candidate):
+                text = candidate
+                granularity = max(granularity - 1, 2)
+                break
+        else:
+            if size == 1:
+                break
+            granularity = min(granularity * 2, len(text))
+    return text
+
+
+def shrink(mismatch, engine, reference, bindings):
+    """
+    the shortest text found which makes engine disagree the same way
+    """
+    rank = GRAMMARS.index(engine.grammar)
+
+    def failing(text):
+        if GRAMMARS.index(grammar(text)) > rank:
+            return False
+        found = compare(engine, reference, text, bindings)
+        return found is not None and found.kind == mismatch.kind
+
+    text = minimize(mismatch.text, failing)
+    return compare(engine, reference, text, bindings) or mismatch
+
+
+def fuzz(engines, count=1000, seed=0, bindings=BINDINGS, rows=4):
+    """
+    every Mismatch with the first of engines on count random texts, rows
+    texts share each shape
+    """
+    rng = random.Random(seed)
+    texts = []
+    while len(texts) < count:
+        generator = Generator(rng, rng.choice(GRAMMARS))
+        shape = generator.shape()
+        texts.extend(generator.corrupt(generator.fill(shape))
+                     for _ in range(rows))
+    ranks = [GRAMMARS.index(grammar(text)) for text in texts]
+
+    reference = engines[0]
+    expected = reference.run(texts, bindings)
+    mismatches = []
+    for engine in engines[1:]:
+        rank = GRAMMARS.index(engine.grammar)
+        chosen = [index for index, text_rank in enumerate(ranks)
+                  if text_rank <= rank]
+        got = engine.run([texts[index] for index in chosen], bindings)
+        for index, outcome in zip(chosen, got):
+            if not same(expected[index], outcome, engine.messages):
+                mismatches.append(Mismatch(engine.name, texts[index],
+                                           expected[index], outcome))
+    return mismatches
+
+
+def reproducers(mismatches, engines, bindings=BINDINGS, per_kind=1):
+    """
+    the shrunk texts of the first per_kind mismatches of each engine and
+    kind, plus how many mismatches there were of each
+    """
+    by_name = {engine.name: engine for engine in engines}
+    counts = {}
+    found = []
+    for mismatch in mismatches:
+        key = (mismatch.engine, mismatch.kind)
+        counts[key] = counts.get(key, 0) + 1
+        if counts[key] <= per_kind:
+            found.append(shrink(mismatch, by_name[mismatch.engine],
+                                engines[0], bindings))
+    return found, counts
+
+
+def lex(text, bindings):
+    lexer = Lexer(text)
+    return lambda: list(lexer.tokens)
+
+
+def parse(text, bindings):
+    # the lexer runs on demand of the parser, this includes lexing
+    return lambda: Parser(Lexer(text)).parse()
+
+
+def interpret(text, bindings):
+    return Interpreter(Parser(Lexer(text)).parse(), bindings).interpret
+
+
+def one_pass(text, bindings):
+    return lambda: evaluate(text, bindings)
+
+
+# stage name -> function preparing a text and returning the work to measure
+STAGES = {'lex': lex, 'parse': parse, 'evaluate': interpret,
+          'onepass': one_pass}
+
+
+def measure(work, what='time', repeat=3):
+    """
+    the best time in seconds or the peak of newly allocated bytes of work(),
+    errors are part of the work
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        if what == 'memory':
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+        else:
+            start = perf_counter()
+        try:
+            work()
+        except Exception:
+            pass
+        if what == 'memory':
+            spent = tracemalloc.get_traced_memory()[1] - start
+            tracemalloc.stop()
+        else:
+            spent = perf_counter() - start
+        best = min(best, spent)
+    return best
+
+
+def score(text, stage, what='time', bindings=BINDINGS, repeat=3):
+    """
+    cost of text in stage per byte, 0 when it doesn't get that far
+    """
+    try:
+        work = STAGES[stage](text, bindings)
+    except Exception:
+        return 0
+    return measure(work, what, repeat) / max(len(text.encode()), 1)
+
+
+def plain(size):
+    return '+'.join('1' * ((size + 1) // 2))
+
+
+def mutate(rng, text):
+    i, j = sorted(rng.randrange(len(text) + 1) for _ in range(2))
+    choice = rng.randrange(5)
+    if choice == 0:
+        return text[:i] + text[j:]
+    if choice == 1:
+        return text[:i] + rng.choice(SNIPPETS) + text[i:]
+    if choice == 2:
+        generator = Generator(rng, 'calc8', 2)
+        return text[:i] + generator.fill(generator.shape()) + text[j:]
+    if choice == 3:
+        return text[:i] + text[i:j] * rng.randint(2, 8) + text[j:]
+    return rng.choice(['(%s)', '-%s', 'not %s', '%s ? 1 : 0']) % text
+
+
+def search(stage='evaluate', what='time', rounds=500, seed=0, min_size=64,
+           max_size=1024, population=8, bindings=BINDINGS):
+    """
+    hill climb towards texts of min_size to max_size bytes costing the most
+    per byte. returns (cost per byte, times a plain sum of the same size,
+    text) of the best texts found, worst last.
+    """
+    # score() takes any error for a text that doesn't get far enough
+    if stage not in STAGES:
+        raise ValueError('unknown stage %r, pick one of %s' % (
+            stage, ', '.join(STAGES)))
+    if what not in {'time', 'memory'}:
+        raise ValueError("what must be 'time' or 'memory', not %r" % what)
+    rng = random.Random(seed)
+    best = []
+    while len(best) < population:
+        text = ''
+        while len(text) < min_size:
+            generator = Generator(rng, 'calc8')
+            text += ('+(%s)' if text else '(%s)') % generator.fill(
+                generator.shape())
+        if len(text.encode()) <= max_size:
+            best.append((score(text, stage, what, bindings), text))
+    seen = {text for _, text in best}
+
+    for _ in range(rounds):
+        best.sort(reverse=True)
+        parent = best[int(rng.random() ** 2 * len(best))][1]
+        text = mutate(rng, parent)
+        if text in seen or \
+                not min_size <= len(text.encode()) <= max_size:
+            continue
+        seen.add(text)
+        per_byte = score(text, stage, what, bindings)
+        if per_byte > best[-1][0]:
+            best[-1] = (per_byte, text)
+
+    found = []
+    for _, text in best:
+        per_byte = score(text, stage, what, bindings, repeat=10)
+        baseline = score(plain(len(text.encode())), stage, what, bindings,
+                         repeat=10)
+        found.append((per_byte,
+                      per_byte / baseline if baseline else float('inf'),
+                      text))
+    return sorted(found, reverse=True)
+
+
+def main():
+    if sys.argv[1:2] == ['search']:
+        what = sys.argv[2] if len(sys.argv) > 2 else 'time'
+        stage = sys.argv[3] if len(sys.argv) > 3 else 'evaluate'
+        rounds = int(sys.argv[4]) if len(sys.argv) > 4 else 500
+        seed = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+        if what not in {'time', 'memory'} or stage not in STAGES:
+            sys.exit(__doc__[__doc__.index('usage:'):].rstrip())
+        unit = 'ns' if what == 'time' else 'B'
+        scale = 1e9 if what == 'time' else 1
+        for per_byte, factor, text in search(stage, what, rounds, seed):
+            print('%10.1f %s/byte  x%-7.1f %r' % (per_byte * scale, unit,
+                                                   factor, text[:100]))
+        return
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    with ProcessPoolExecutor(2) as processes, \
+            ThreadPoolEvaluator(4, chunk_size=16) as threads:
+        found = engines(processes, threads)
+        if len(sys.argv) > 3:
+            names = sys.argv[3].split(',')
+            found = found[:1] + [engine for engine in found[1:]
+                                 if engine.name in names]
+        mismatches = fuzz(found, count, seed)
+        new = [mismatch for mismatch in mismatches if not known(mismatch)]
+        shrunk, counts = reproducers(new, found)
+    for (name, kind), number in sorted(counts.items()):
+        print('%s: %d mismatches, calc8 %s %s, %s %s %s' % (
+            name, number, kind[0], kind[1], name, kind[2], kind[3]))
+    for mismatch in shrunk:
+        print(mismatch)
+    print('%d texts, %d new mismatches, %d known' % (
+        count, len(new), len(mismatches) - len(new)))
+
+
+if __name__ == '__main__':
+    main()
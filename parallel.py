@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+"""
+evaluate one huge expression on several processes
+
+the input is scanned once for paren depth and cut at the depth 0 binary
+`+`/`-` (or, when it is a single term, at the depth 0 `*`/`/`). the pieces
+are parsed and evaluated by worker processes and the main process combines
+their values left to right with the same operators the sequential
+interpreter would apply, so floats come out bit-identical. input with a
+comparison, `and`/`or`/`not` or `?:` outside parens isn't cut at all. that
+and anything else the scanner isn't sure about (syntax errors, trailing
+garbage, evaluation errors) is handed to the sequential interpreter, so
+errors are identical too.
+
+usage: parallel.py FILE [WORKERS]
+"""
+from concurrent.futures import ProcessPoolExecutor
+import math
+import operator
+import os
+import re
+import sys
+
+from calc8 import EOF, Interpreter, Lexer, Parser, compile_formula
+
+# a keyword right after a letter or `_` is the end of a longer name, after
+# a digit it may be one too, matching it anyway only costs the parallelism
+OPERATORS = re.compile(
+    r'[-+*/()<>=!?:]|(?<![A-Za-z_])(?:and|or|not)(?![A-Za-z0-9_])')
+
+
+def split(text, ops):
+    """
+    (op, start, end) of every piece of text between the depth 0 binary
+    operators in ops, op of the first piece is None. cutting stops at the
+    first depth 0 unary operator since it swallows the rest of the input.
+    None if the parens don't balance or there is a depth 0 comparison,
+    boolean or conditional operator, which binds looser than the pieces.
+    """
+    pieces = []
+    depth = 0
+    previous = None
+    previous_end = 0
+    op = None
+    start = 0
+    for match in OPERATORS.finditer(text):
+        char = match.group()
+        pos = match.start()
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth < 0:
+                return None
+        elif depth == 0 and char not in '+-*/':
+            return None
+        elif depth == 0:
+            operand = previous == ')' or not (
+                text[previous_end:pos].isspace() or previous_end == pos)
+            if not operand:
+                if char in '+-':
+                    break
+            elif char in ops:
+                pieces.append((op, start, pos))
+                op = Lexer.op_value_map[char]
+                start = match.end()
+        previous = char
+        previous_end = match.end()
+    if depth != 0:
+        return None
+    pieces.append((op, start, len(text)))
+    return pieces
+
+
+def evaluate_pieces(text, pieces, rule, bindings):
+    """
+    pieces are (op, start, end) slices of text, each one has to parse
+    completely with Parser.<rule>. returns the values and, when they are all
+    integers, their exact aggregate; None when the sequential interpreter
+    has to take over.
+    """
+    values = []
+    try:
+        for _, start, end in pieces:
+            parser = Parser(Lexer(text[start:end].rstrip()))
+            node = getattr(parser, rule)()
+            if parser.current_token.type != EOF:
+                return None
+            values.append(Interpreter(node, bindings).interpret())
+    except Exception:
+        return None
+    aggregate = None
+    if all(type(value) is int for value in values):
+        ops = [op for op, _, _ in pieces]
+        if rule == 'term':
+            aggregate = sum(-value if op is operator.sub else value
+                            for op, value in zip(ops, values))
+        elif all(op in {None, operator.mul} for op in ops):
+            aggregate = math.prod(values)
+    return values, aggregate
+
+
+def chunk(text, pieces, count):
+    """
+    group consecutive pieces into about count chunks of similar text size,
+    every chunk is (text, pieces relative to that text)
+    """
+    size = len(text) // count + 1
+    group = []
+    for piece in pieces:
+        group.append(piece)
+        if group[-1][2] - group[0][1] >= size:
+            yield rebase(text, group)
+            group = []
+    if group:
+        yield rebase(text, group)
+
+
+def rebase(text, group):
+    base = group[0][1]
+    return (text[base:group[-1][2]],
+            [(op, start - base, end - base) for op, start, end in group])
+
+
+def evaluate(text, bindings=None, workers=None, min_size=1 << 20,
+             executor=None):
+    """
+    executor is a running executor to reuse, by default a process pool of
+    workers processes is started for the call
+    """
+    workers = workers or os.cpu_count() or 1
+    if len(text) < min_size or workers < 2 or not text.isascii() or \
+            '\0' in text or text != text.strip():
+        return compile_formula(text).evaluate(bindings)
+
+    rule = 'term'
+    pieces = split(text, '+-')
+    if pieces is not None and len(pieces) == 1:
+        rule = 'factor'
+        pieces = split(text, '*/')
+    if pieces is None or len(pieces) == 1:
+        return compile_formula(text).evaluate(bindings)
+
+    chunks = list(chunk(text, pieces, workers * 4))
+    arguments = zip(*[(chunk_text, chunk_pieces, rule, bindings)
+                      for chunk_text, chunk_pieces in chunks])
+    if executor is None:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(evaluate_pieces, *arguments))
+    else:
+        results = list(executor.map(evaluate_pieces, *arguments))
+    if None in results:
+        return compile_formula(text).evaluate(bindings)
+
+    result = None
+    for (values, aggregate), (_, chunk_pieces) in zip(results, chunks):
+        if aggregate is not None and type(result) in {int, type(None)}:
+            if result is None:
+                result = aggregate
+            elif rule == 'term':
+                result = result + aggregate
+            else:
+                result = result * aggregate
+            continue
+        for (op, _, _), value in zip(chunk_pieces, values):
+            result = value if op is None else op(result, value)
+    return result
+
+
+def main():
+    with open(sys.argv[1]) as f:
+        text = f.read().strip()
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    print(evaluate(text, workers=workers))
+
+
+if __name__ == '__main__':
+    main()
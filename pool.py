@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+"""
+evaluate a queue of (formula, bindings) jobs on a thread pool
+
+formulas come from calc8.compile_formula and are immutable, every job gets
+its own Interpreter, so nothing but the job queue is shared between workers.
+on a free-threaded build the workers run truly in parallel.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import os
+
+
+class ThreadPoolEvaluator(object):
+
+    def __init__(self, max_workers=None, chunk_size=256):
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    @staticmethod
+    def run(chunk):
+        return [formula.evaluate(bindings) for formula, bindings in chunk]
+
+    def map(self, jobs):
+        """
+        yield the results in job order, at most two chunks per worker are in
+        flight so arbitrarily long (or endless) job iterators are fine
+        """
+        jobs = iter(jobs)
+        window = 2 * self.max_workers
+        pending = deque()
+        while True:
+            while len(pending) < window:
+                chunk = list(islice(jobs, self.chunk_size))
+                if not chunk:
+                    break
+                pending.append(self.executor.submit(self.run, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+    def evaluate(self, jobs):
+        return list(self.map(jobs))
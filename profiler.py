@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+"""
+per node profile of a calc8 formula
+
+ProfilingInterpreter records how often each node ran and its inclusive and
+exclusive (minus its children) time, Profile maps the hottest nodes back to
+their source text, line and column.
+
+usage: profiler.py FILE [TOP]
+"""
+import json
+import sys
+from time import perf_counter
+
+from calc8 import Interpreter, compile_formula
+
+
+class NodeStats(object):
+
+    def __init__(self, node):
+        self.node = node
+        self.calls = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+
+
+class ProfilingInterpreter(Interpreter):
+
+    def __init__(self, tree, bindings=None):
+        super().__init__(tree, bindings)
+        self.stats = {}
+        # inclusive time of the children of every node being visited
+        self.children_time = []
+
+    def visit(self, node):
+        self.children_time.append(0.0)
+        start = perf_counter()
+        try:
+            return super().visit(node)
+        finally:
+            elapsed = perf_counter() - start
+            exclusive = elapsed - self.children_time.pop()
+            if self.children_time:
+                self.children_time[-1] += elapsed
+            stats = self.stats.get(id(node))
+            if stats is None:
+                stats = self.stats[id(node)] = NodeStats(node)
+            stats.calls += 1
+            stats.inclusive += elapsed
+            stats.exclusive += exclusive
+
+
+class Profile(object):
+
+    def __init__(self, text, stats):
+        self.text = text
+        self.stats = stats
+
+    def location(self, offset):
+        line_start = self.text.rfind('\n', 0, offset) + 1
+        return self.text.count('\n', 0, offset) + 1, offset - line_start + 1
+
+    def source(self, node, width=60):
+        if node.span is None or self.text is None:
+            return '?'
+        source = ' '.join(self.text[node.span[0]:node.span[1]].split())
+        if len(source) > width:
+            source = source[:width - 3] + '...'
+        return source
+
+    def hottest(self, top=10, key='exclusive'):
+        return sorted(self.stats, key=lambda stats: getattr(stats, key),
+                      reverse=True)[:top]
+
+    def records(self, top=10, key='exclusive'):
+        records = []
+        for stats in self.hottest(top, key):
+            span = stats.node.span
+            line, column = (None, None) if span is None else \
+                self.location(span[0])
+            records.append({
+                'node': type(stats.node).__name__,
+                'source': self.source(stats.node),
+                'span': span,
+                'line': line,
+                'column': column,
+                'calls': stats.calls,
+                'inclusive': stats.inclusive,
+                'exclusive': stats.exclusive,
+            })
+        return records
+
+    def render_text(self, top=10, key='exclusive'):
+        lines = ['%10s %10s %6s %9s  %s' % ('exclusive', 'inclusive',
+                                            'calls', 'line:col', 'source')]
+        for record in self.records(top, key):
+            lines.append('%9.6fs %9.6fs %6d %9s  %s' % (
+                record['exclusive'], record['inclusive'], record['calls'],
+                '%s:%s' % (record['line'], record['column']),
+                record['source']))
+        return '\n'.join(lines)
+
+    def to_json(self, top=10, key='exclusive'):
+        return json.dumps(self.records(top, key), indent=2)
+
+
+def profile(formula, bindings=None, repeat=1):
+    """
+    nodes are mapped back to the source only if formula was compiled with
+    spans=True
+    """
+    interpreter = ProfilingInterpreter(formula.tree, bindings)
+    for _ in range(repeat):
+        interpreter.interpret()
+    return Profile(formula.text, list(interpreter.stats.values()))
+
+
+def main():
+    with open(sys.argv[1]) as f:
+        formula = compile_formula(f.read().strip(), spans=True)
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(profile(formula).render_text(top))
+
+
+if __name__ == '__main__':
+    main()
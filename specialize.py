@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+"""
+partial evaluation of calc8 trees
+
+specialize() substitutes the bindings known for a whole run and folds every
+subtree that became constant, the residual tree only contains the parts
+that depend on the remaining variables. folding evaluates exactly the same
+operations in the same order the Interpreter would, so results don't
+change, and a fold that raises is left in the tree to raise at evaluation
+time like before.
+"""
+import operator
+
+from calc8 import (And, Compare, Cond, Formula, Interpreter, NodeVisitor, Num,
+                   Or, Product, Sum, UnaryOp)
+
+
+class Specializer(NodeVisitor):
+
+    def __init__(self, known_bindings):
+        self.known_bindings = known_bindings
+
+    def fold(self, node):
+        try:
+            return Num(Interpreter(node).interpret(), node.span)
+        except ArithmeticError:
+            return node
+
+    def visit_Num(self, node):
+        return node
+
+    def visit_Var(self, node):
+        if node.name in self.known_bindings:
+            return Num(self.known_bindings[node.name], node.span)
+        return node
+
+    def visit_Sum(self, node):
+        return self.reduce(node, Sum, node.negated)
+
+    def visit_Product(self, node):
+        return self.reduce(node, Product, node.inverted)
+
+    def reduce(self, node, cls, flags):
+        """
+        the constant operands up front fold into one, they are the first
+        operations evaluated anyway
+        """
+        operands = [self.visit(operand) for operand in node.operands]
+        run = 0
+        while run < len(operands) and isinstance(operands[run], Num):
+            run += 1
+        if run == len(operands):
+            return self.fold(cls(tuple(operands), flags, node.span))
+        if run > 1:
+            head = self.fold(cls(tuple(operands[:run]), flags[:run]))
+            if isinstance(head, Num):
+                operands[:run] = [head]
+                flags = flags[:1] + flags[run:]
+        if all(map(operator.is_, operands, node.operands)) and \
+                len(operands) == len(node.operands):
+            return node
+        return cls(tuple(operands), flags, node.span)
+
+    def visit_UnaryOp(self, node):
+        child = self.visit(node.child)
+        if child is not node.child:
+            node = UnaryOp(node.op, child, node.span)
+        if isinstance(child, Num):
+            return self.fold(node)
+        return node
+
+    def visit_Compare(self, node):
+        operands = tuple(map(self.visit, node.operands))
+        if operands != node.operands:
+            node = Compare(operands, node.ops, node.span)
+        if all(isinstance(operand, Num) for operand in operands):
+            return self.fold(node)
+        return node
+
+    def visit_And(self, node):
+        return self.logical(node, And, False)
+
+    def visit_Or(self, node):
+        return self.logical(node, Or, True)
+
+    def logical(self, node, cls, stop):
+        """
+        constant operands that don't decide the result are dropped, one that
+        does ends the chain since nothing after it gets evaluated
+        """
+        operands = []
+        for operand in node.operands:
+            operand = self.visit(operand)
+            if not isinstance(operand, Num):
+                operands.append(operand)
+            elif bool(operand.value) is stop:
+                if not operands:
+                    return Num(stop, node.span)
+                operands.append(operand)
+                break
+        if not operands:
+            return Num(not stop, node.span)
+        return cls(tuple(operands), node.span)
+
+    def visit_Cond(self, node):
+        test = self.visit(node.test)
+        if isinstance(test, Num):
+            return self.visit(node.body if test.value else node.orelse)
+        return Cond(test, self.visit(node.body), self.visit(node.orelse),
+                    node.span)
+
+
+def specialize(tree, known_bindings):
+    """
+    tree may be a Formula too, the residual is then a Formula without text
+    """
+    if isinstance(tree, Formula):
+        return Formula(None, specialize(tree.tree, known_bindings))
+    return Specializer(known_bindings).visit(tree)